@@ -1,9 +1,13 @@
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
-from datetime import datetime
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+from collections import deque
+import numpy as np
+import pandas as pd
+import queue
 import time
 import threading
-import pytz
+import uuid
+from types import MappingProxyType
 from logistic import LogisticsOptimizer  # 导入之前的算法核心
 
 # 初始化系统状态
@@ -12,10 +16,53 @@ def init_system():
     if 'optimizer' not in st.session_state:
         st.session_state.optimizer = LogisticsOptimizer(
             factory_location=(31.2304, 121.4737))
+    if 'session_token' not in st.session_state:
+        # 会话级稳定标识，作为跨会话共享缓存的键（id()在对象释放后会被复用）
+        st.session_state.session_token = uuid.uuid4().hex
     if 'running' not in st.session_state:
         st.session_state.running = False
     if 'last_update' not in st.session_state:
-        st.session_state.last_update = datetime.now(pytz.utc)
+        st.session_state.last_update = time.monotonic()
+    if 'messages' not in st.session_state:
+        # 后台线程不能直接调用st.error/st.toast，消息经队列交给前台片段显示
+        st.session_state.messages = queue.Queue()
+    if 'event_ring' not in st.session_state:
+        # 事件环形缓冲：优化线程append，事件片段popleft批量取出，均无需加锁
+        st.session_state.event_ring = deque(maxlen=1024)
+    if 'events' not in st.session_state:
+        # 最近3条事件，最新的在最前；仅由事件片段写入
+        st.session_state.events = deque(maxlen=3)
+
+# 看板只读快照：优化线程整体替换引用，读者拿到的快照不会再被修改
+EMPTY_SNAP = MappingProxyType({"vehicles": (), "production": ()})
+
+EVENT_BATCH = 16  # 事件片段每次刷新最多取出的事件数
+
+def get_snapshot():
+    return st.session_state.get('dashboard_snap', EMPTY_SNAP)
+
+# 内容哈希与上次记录的不同时返回True；用于跳过未变化面板的数据重建。
+# 重建成功后再调用commit_hash记录，重建失败时下次仍会重试
+def content_changed(key, h):
+    return st.session_state.get(key) != h
+
+def commit_hash(key, h):
+    st.session_state[key] = h
+
+# 生产数据按小时缓存；_data_stream不参与哈希，用session_token区分各会话的DataStream，
+# bucket按时间分段。天气、路况、订单的TTL缓存在DataStream内部完成
+def _bucket(ttl):
+    return int(time.time() // ttl)
+
+@st.cache_data(ttl=3600)
+def cached_production(_data_stream, session_token, bucket):
+    return [
+        {
+            "type": p.type,
+            "amount": p.amount
+        }
+        for p in _data_stream.get_hourly_production()
+    ]
 
 # 实时数据看板
 def display_dashboard():
@@ -55,72 +102,119 @@ def display_dashboard():
         #          on_click=toggle_optimization)
 
 # 地图组件
+@st.fragment(run_every=2)
 def update_map():
     try:
-        import pydeck as pdk
-        
-        vehicle_data = [{
-            "coordinates": v['position'][::-1],  # 转换为[lng, lat]
-            "color": [52, 152, 219],
-            "radius": 50
-        } for v in st.session_state.get('vehicles', [])]
-        
-        st.pydeck_chart(pdk.Deck(
-            map_style='road',
-            initial_view_state=pdk.ViewState(
-                latitude=31.2304,
-                longitude=121.4737,
-                zoom=12,
-                pitch=50
-            ),
-            layers=[
-                pdk.Layer(
-                    'ScatterplotLayer',
-                    data=vehicle_data,
-                    get_position='coordinates',
-                    get_color='color',
-                    get_radius='radius',
-                    pickable=True
-                )
-            ]
-        ))
+        # Deck只构建一次，车辆位置变化时才替换图层数据
+        vehicles = get_snapshot()['vehicles']
+        h = hash(tuple((v['id'], v['position']) for v in vehicles))
+        changed = content_changed('_map_hash', h)
+        if 'deck' not in st.session_state:
+            st.session_state.deck = make_deck()
+            changed = True
+        deck = st.session_state.deck
+
+        if changed:
+            positions = np.asarray(
+                [v['position'] for v in vehicles],
+                dtype=np.float64
+            ).reshape(-1, 2)
+            deck.layers[0].data = pd.DataFrame(positions[:, ::-1], columns=['lng', 'lat'])  # 转换为[lng, lat]
+            commit_hash('_map_hash', h)
+        st.pydeck_chart(deck)
     except Exception as e:
         st.error(f"地图加载失败: {str(e)}")
 
+def make_deck():
+    import pydeck as pdk
+
+    return pdk.Deck(
+        map_style='road',
+        initial_view_state=pdk.ViewState(
+            latitude=31.2304,
+            longitude=121.4737,
+            zoom=12,
+            pitch=50
+        ),
+        layers=[
+            pdk.Layer(
+                'ScatterplotLayer',
+                data=pd.DataFrame(columns=['lng', 'lat']),
+                get_position=['lng', 'lat'],
+                get_color=[52, 152, 219],
+                get_radius=50,
+                pickable=True
+            )
+        ]
+    )
+
 # 生产数据展示
+@st.fragment(run_every=2)
 def display_production():
-    production = st.session_state.get('production', [])
+    production = get_snapshot()['production']
     if production:
-        st.bar_chart(
-            {p['type']: p['amount'] for p in production},
-            color='#3498db'
-        )
+        # 复用同一个DataFrame，数据变化时才更新；产品种类不变时只整体更新数量列
+        df = st.session_state.get('production_df')
+        h = hash(tuple((p['type'], p['amount']) for p in production))
+        if df is None or content_changed('_production_hash', h):
+            types = [p['type'] for p in production]
+            if df is None or list(df.index) != types:
+                df = pd.DataFrame({'amount': 0}, index=pd.Index(types, name='type'))
+                st.session_state.production_df = df
+            df['amount'] = [p['amount'] for p in production]
+            commit_hash('_production_hash', h)
+        st.bar_chart(df, y='amount', color='#3498db')
         for p in production:
             st.caption(f"{p['type']}: {p['amount']}件")
     else:
         st.info("暂无生产数据")
 
 # 车辆状态展示
+@st.fragment(run_every=2)
 def display_vehicles():
-    vehicles = st.session_state.get('vehicles', [])
+    vehicles = get_snapshot()['vehicles']
     for v in vehicles:
-        progress = v['load'] / v['capacity']
         st.metric(
             label=f"车辆 {v['id']}",
             value=f"{v['load']}/{v['capacity']}",
             help=f"位置: {v['position']}"
         )
-        st.progress(progress)
+        st.progress(v['progress'])
 
 # 事件通知
+@st.fragment(run_every=2)
 def display_events():
-    events = st.session_state.get('events', [])
+    drain_messages()
+    ring = st.session_state.get('event_ring', ())
+    batch = [ring.popleft() for _ in range(min(len(ring), EVENT_BATCH))]
+    events = st.session_state.get('events', deque(maxlen=3))
+    if batch:
+        events.extendleft(batch)  # batch按时间先后排列，extendleft后最新的在最前
+        text = f"新事件: {batch[-1]['type']}"
+        if len(batch) > 1:
+            text += f" 等{len(batch)}条"
+        st.toast(text, icon="⚠️")
     if events:
-        for event in events[-3:]:  # 显示最近3条
+        for event in events:
             st.error(f"⚠️ {event['type']} @ {event['time']}")
     else:
         st.info("当前无待处理事件")
 
+# 显示后台线程推送的消息
+def drain_messages():
+    messages = st.session_state.get('messages')
+    if messages is None:
+        return
+    while True:
+        try:
+            level, text = messages.get_nowait()
+        except queue.Empty:
+            break
+        if level == 'error':
+            st.error(text)
+        else:
+            st.toast(text, icon="⚠️")
+
 # 优化控制线程
 def optimization_thread():
     while st.session_state.running:
@@ -128,57 +222,58 @@ def optimization_thread():
             # 执行优化逻辑
             st.session_state.optimizer._update_data()
             
-            # 更新共享数据
-            current_time = datetime.now(pytz.utc)
-            if (current_time - st.session_state.last_update).seconds >= 1:
-                with st.session_state.optimizer.data_stream.lock:
-                    # 更新车辆数据
-                    st.session_state.vehicles = [
-                        {
-                            "id": v.id,
-                            "position": v.position,
-                            "load": v.current_load,
-                            "capacity": v.capacity
-                        }
-                        for v in st.session_state.optimizer.data_stream.get_vehicle_states()
-                    ]
-                    
-                    # 更新生产数据
-                    st.session_state.production = [
-                        {
-                            "type": p.type,
-                            "amount": p.amount
-                        }
-                        for p in st.session_state.optimizer.data_stream.get_hourly_production()
-                    ]
-                    
-                    # 处理事件
-                    new_events = st.session_state.optimizer.data_stream.events
-                    if new_events:
-                        st.session_state.events = [{
-                            "type": e['type'],
-                            "time": current_time.strftime("%H:%M:%S"),
-                            "location": e['location']
-                        } for e in new_events]
-                        st.toast(f"新事件: {new_events[-1]['type']}", icon="⚠️")
-                
-                st.session_state.last_update = current_time
-                time.sleep(0.5)
+            # 更新共享数据：先在锁外构建完整快照，再一次性替换引用，配合fastReruns
+            now = time.monotonic()
+            if now - st.session_state.last_update >= 1.0:
+                data_stream = st.session_state.optimizer.data_stream
+
+                # 车辆数据，负载率一次向量计算
+                fleet = data_stream.get_vehicle_states()
+                progress = fleet.load_ratio()
+                vehicles = tuple(
+                    {
+                        "id": v.id,
+                        "position": v.position,
+                        "load": v.current_load,
+                        "capacity": v.capacity,
+                        "progress": float(progress[i])
+                    }
+                    for i, v in enumerate(fleet.iter())
+                )
+
+                # 生产数据
+                production = tuple(cached_production(
+                    data_stream, st.session_state.session_token, _bucket(3600)))
+
+                # 处理事件：写入环形缓冲，由事件片段批量取出显示
+                if data_stream.has_event():
+                    e = data_stream.get_event()
+                    st.session_state.event_ring.append({
+                        "type": e['type'],
+                        "time": time.strftime("%H:%M:%S", time.gmtime()),
+                        "location": e['location']
+                    })
+
+                st.session_state.dashboard_snap = MappingProxyType({
+                    "vehicles": vehicles,
+                    "production": production
+                })
+                st.session_state.last_update = now
+            time.sleep(0.5)
                 
         except Exception as e:
-            st.error(f"优化进程错误: {str(e)}")
+            st.session_state.messages.put(('error', f"优化进程错误: {str(e)}"))
             st.session_state.running = False
 
 # 启动/停止优化
 def toggle_optimization():
     st.session_state.running = not st.session_state.running
     if st.session_state.running:
-        threading.Thread(target=optimization_thread, daemon=True).start()
+        t = threading.Thread(target=optimization_thread, daemon=True)
+        add_script_run_ctx(t)
+        t.start()
 
 # 主程序
 if __name__ == "__main__":
     init_system()
     display_dashboard()
-    
-    # 自动刷新页面（每2秒）
-    st_autorefresh(interval=2000, key="dashboard_refresh")
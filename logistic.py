@@ -1,10 +1,24 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from numba import njit
+import numpy as np
 import pytz # type: ignore
-import random
+import sys
+from pyvrp import Model
+from pyvrp.stop import MaxRuntime
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
 import time
 
+MAX_PRODUCTS = 2  # 工厂产品种类数
+_EVENT_TYPES = tuple(map(sys.intern, ['accident', 'traffic_jam', 'weather_alert', 'order_change']))
+_TRAFFIC_LEVELS = ('畅通', '缓行', '拥堵')
+_WEATHER_TYPES = ('晴', '雨', '雾')
+
 # ================= 基础数据类定义 =================
 class DeliveryDemand:
+    __slots__ = ('type', 'quantity', 'location', 'time_window')
+
     def __init__(self, product_type, quantity, location, time_window):
         self.type = product_type
         self.quantity = quantity
@@ -12,6 +26,8 @@ class DeliveryDemand:
         self.time_window = time_window  # 元组(start_time, end_time)
 
 class VehicleState:
+    __slots__ = ('id', 'position', 'capacity', 'current_load', 'route')
+
     def __init__(self, vehicle_id, position, capacity, current_load, route):
         self.id = vehicle_id
         self.position = position  # (lat, lng)
@@ -19,7 +35,34 @@ class VehicleState:
         self.current_load = current_load
         self.route = route
 
+# 车队状态的列式存储，各数组按车辆索引对齐
+@dataclass
+class FleetSoA:
+    ids: np.ndarray           # int32[N]
+    positions: np.ndarray     # float64[N, 2]，每行(lat, lng)
+    capacity: np.ndarray      # int32[N]
+    load: np.ndarray          # int32[N]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load_ratio(self):
+        return self.load / self.capacity
+
+    def iter(self):
+        # 逐辆车生成VehicleState，供需要逐条处理的显示代码使用
+        for i in range(len(self)):
+            yield VehicleState(
+                int(self.ids[i]),
+                (float(self.positions[i, 0]), float(self.positions[i, 1])),
+                int(self.capacity[i]),
+                int(self.load[i]),
+                []
+            )
+
 class FactoryProduction:
+    __slots__ = ('type', 'amount', 'timestamp')
+
     def __init__(self, product_type, amount, production_time):
         self.type = product_type
         self.amount = amount
@@ -33,34 +76,72 @@ class DataStream:
         self.traffic = TrafficMonitor()
         self.weather = WeatherService()
         self.factory = FactorySystem()
+        self._positions = None  # 车辆坐标缓存，(N, 2)数组
+        self._vehicle_ids = None  # 与_positions按行对齐的车辆ID
+        self._vehicle_tree = None
+        self._tree_key = None  # 建树时坐标数组的哈希
+        self._rng = np.random.default_rng()
+        self._ttl_cache = {}  # key -> (过期时刻, 值)
+
+    def _cached(self, key, ttl, fetch):
+        # 按time.monotonic计时的TTL缓存，避免每个tick都调用子系统
+        now = time.monotonic()
+        entry = self._ttl_cache.get(key)
+        if entry is None or now >= entry[0]:
+            entry = (now + ttl, fetch())
+            self._ttl_cache[key] = entry
+        return entry[1]
 
     def preprocess(self):
         return {
             'orders': self.orders.get_latest(),
             'positions': self.vehicles.get_gps(),
-            'congestion': self.traffic.get_levels(),
-            'weather': self.weather.get_conditions()
+            'congestion': self._cached('congestion', 60, self.traffic.get_levels),
+            'weather': self._cached('weather', 300, self.weather.get_conditions)
         }
 
     def get_hourly_production(self):
         return self.factory.get_production()
 
     def get_pending_orders(self):
-        return self.orders.get_pending()
+        return self._cached('pending', 60, self.orders.get_pending)
 
     def get_vehicle_states(self):
         return self.vehicles.get_status()
 
+    def get_vehicle_positions(self):
+        if self._positions is None:
+            fleet = self.get_vehicle_states()
+            self._positions = fleet.positions
+            self._vehicle_ids = fleet.ids
+        return self._positions
+
+    def invalidate_positions(self):
+        self._positions = None
+        self._vehicle_ids = None
+
+    def nearest_vehicle(self, location):
+        positions = self.get_vehicle_positions()
+        if not len(positions):
+            return None
+        # 坐标未变化时复用已有KD树
+        key = hash(positions.tobytes())
+        if key != self._tree_key:
+            self._vehicle_tree = cKDTree(positions)
+            self._tree_key = key
+        distance, index = self._vehicle_tree.query(location, k=1)
+        return distance, int(self._vehicle_ids[index])
+
     def has_event(self):
-        return random.random() < 0.2
+        return self._rng.random() < 0.2
 
     def get_event(self):
-        events = ['accident', 'traffic_jam', 'weather_alert', 'order_change']
+        offset = self._rng.uniform(-0.1, 0.1, 2)
         return {
-            'type': random.choice(events),
+            'type': _EVENT_TYPES[self._rng.integers(len(_EVENT_TYPES))],
             'location': (
-                31.23 + random.uniform(-0.1, 0.1),
-                121.47 + random.uniform(-0.1, 0.1)
+                31.23 + float(offset[0]),
+                121.47 + float(offset[1])
             )
         }
 
@@ -84,59 +165,100 @@ class OrderSystem:
         return []
 
 class TelematicsSystem:
-    def get_gps(self):
-        return [
-            (31.2304 + random.uniform(-0.01, 0.01),
-             121.4737 + random.uniform(-0.01, 0.01))
-            for _ in range(3)
-        ]
+    def __init__(self):
+        self._rng = np.random.default_rng()
 
-    def get_status(self):
-        return [
-            VehicleState(i, (31.23, 121.47), 1000, 500, [])
-            for i in range(3)
-        ]
+    def get_gps(self, n=3):
+        # 一次批量采样，返回(n, 2)数组，每行为(lat, lng)
+        lats = 31.2304 + self._rng.uniform(-0.01, 0.01, n)
+        lngs = 121.4737 + self._rng.uniform(-0.01, 0.01, n)
+        return np.column_stack([lats, lngs])
+
+    def get_status(self, n=3):
+        return FleetSoA(
+            ids=np.arange(n, dtype=np.int32),
+            positions=np.tile(np.array([31.23, 121.47], dtype=np.float64), (n, 1)),
+            capacity=np.full(n, 1000, dtype=np.int32),
+            load=np.full(n, 500, dtype=np.int32)
+        )
 
 class TrafficMonitor:
+    def __init__(self):
+        self._rng = np.random.default_rng()
+
     def get_levels(self):
-        return {'current': random.choice(['畅通', '缓行', '拥堵'])}
+        return {'current': _TRAFFIC_LEVELS[self._rng.integers(len(_TRAFFIC_LEVELS))]}
 
 class WeatherService:
+    def __init__(self):
+        self._rng = np.random.default_rng()
+
     def get_conditions(self):
         return {
-            'weather': random.choice(['晴', '雨', '雾']),
-            'road_condition': random.uniform(0.8, 1.0)
+            'weather': _WEATHER_TYPES[self._rng.integers(len(_WEATHER_TYPES))],
+            'road_condition': float(self._rng.uniform(0.8, 1.0))
         }
 
 class FactorySystem:
+    def __init__(self):
+        self._rng = np.random.default_rng()
+        # 产品名固定且会作为字典键使用，预先驻留
+        self._names = tuple(sys.intern(f'产品{chr(65+i)}') for i in range(MAX_PRODUCTS))
+
     def get_production(self):
+        now = datetime.now(pytz.utc)
+        amounts = self._rng.integers(100, 501, size=len(self._names)).tolist()
         return [
-            FactoryProduction(
-                f'产品{chr(65+i)}', 
-                random.randint(100,500),
-                datetime.now(pytz.utc)
-            )
-            for i in range(2)
+            FactoryProduction(name, amount, now)
+            for name, amount in zip(self._names, amounts)
         ]
 
 # ================= 优化算法核心 =================
+METERS_PER_DEGREE = 111_000  # 经纬度差近似换算为米
+VEHICLE_SPEED = 10           # 米/秒，用于由距离估算行驶时间
+
+@njit(cache=True, fastmath=True)
+def route_cost(positions, route_idx, demands):
+    # positions[0]为工厂，route_idx为途经点索引；返回(往返总距离, 总装载量)
+    distance = 0.0
+    load = 0.0
+    prev = 0
+    for k in range(route_idx.shape[0]):
+        cur = route_idx[k]
+        dx = positions[cur, 0] - positions[prev, 0]
+        dy = positions[cur, 1] - positions[prev, 1]
+        distance += np.sqrt(dx * dx + dy * dy)
+        load += demands[cur]
+        prev = cur
+    dx = positions[0, 0] - positions[prev, 0]
+    dy = positions[0, 1] - positions[prev, 1]
+    distance += np.sqrt(dx * dx + dy * dy)
+    return distance, load
+
 class LogisticsOptimizer:
+    _TW_START = timedelta(hours=1, minutes=15)   # 配送时间窗开始（相对生产时刻）
+    _TW_END = timedelta(hours=4)                 # 配送时间窗结束
+    _PROD_CUTOFF = timedelta(minutes=55)         # 只为近55分钟内的生产生成需求
+
     def __init__(self, factory_location):
         self.data_stream = DataStream()
         self.factory_location = factory_location
         self.tz = pytz.timezone('Asia/Shanghai')
-        self.last_optimization = datetime.now(self.tz)
+        self.last_optimization = time.monotonic()
         self.current_solution = Solution([])
+        # route_cost用的复用缓冲区，需求数超出时再扩容
+        self._scratch_positions = np.empty((16, 2), dtype=np.float64)
+        self._scratch_demands = np.empty(16, dtype=np.float64)
 
     def _update_data(self):
         try:
             self.data_stream.preprocess()
+            self.data_stream.invalidate_positions()
         except Exception as e:
             print(f"数据更新异常: {str(e)}")
 
     def _hourly_trigger(self):
-        current = datetime.now(self.tz)
-        return (current - self.last_optimization).seconds >= 3600
+        return time.monotonic() - self.last_optimization >= 3600
 
     def realtime_optimization(self):
         try:
@@ -146,11 +268,14 @@ class LogisticsOptimizer:
                 if self._hourly_trigger():
                     print(f"\n=== 整点优化触发 [{datetime.now(self.tz).strftime('%H:%M')}] ===")
                     self._hourly_reoptimization()
-                    self.last_optimization = datetime.now(self.tz)
+                    self.last_optimization = time.monotonic()
                 
                 if self.data_stream.has_event():
                     event = self.data_stream.get_event()
                     print(f"\n! 事件响应: {event['type']}@{event['location']}")
+                    nearest = self.data_stream.nearest_vehicle(event['location'])
+                    if nearest is not None:
+                        print(f"最近车辆: 车辆{nearest[1]}, 距离{nearest[0]:.4f}")
                     self.current_solution = Solution([f"调整路线@{event['location']}"])
                 
                 self._dispatch_commands()
@@ -164,18 +289,84 @@ class LogisticsOptimizer:
         print(f"新生产货物: {[f'{p.type}x{p.amount}' for p in new_production]}")
         updated_demands = self._generate_demands()
         print(f"总配送需求: {len(updated_demands)}项")
-        self.current_solution = Solution([f"路线{i}" for i in range(len(updated_demands)//3 +1)])
+        positions, demands = self._fill_scratch(updated_demands)
+        try:
+            routes = self._solve_vrp(updated_demands, positions) if updated_demands else []
+        except Exception as e:
+            # 求解失败时保留当前方案，不中断实时优化循环
+            print(f"路线求解异常: {str(e)}")
+            return
+        if routes is None:
+            print("警告: 未找到满足容量与时间窗的可行路线，保留当前方案")
+            return
+        total = sum(route_cost(positions, r, demands)[0] for r in routes)
+        print(f"路线总距离: {total:.4f}")
+        self.current_solution = Solution(routes)
+
+    def _solve_vrp(self, demands, positions):
+        # positions[0]为工厂，其余与demands一一对应；PyVRP只接受整数数据
+        current_time = datetime.now(self.tz)
+        distances = np.rint(cdist(positions, positions) * METERS_PER_DEGREE).astype(np.int64)
+        durations = distances // VEHICLE_SPEED
+        fleet = self.data_stream.get_vehicle_states()
+
+        model = Model()
+        model.add_depot(
+            x=int(round(positions[0, 1] * 1e6)),
+            y=int(round(positions[0, 0] * 1e6))
+        )
+        # 每种容量一个车辆类型，保留车队中各车的实际容量
+        for cap, count in zip(*np.unique(fleet.capacity, return_counts=True)):
+            model.add_vehicle_type(num_available=int(count), capacity=int(cap))
+        for d, (lat, lng) in zip(demands, positions[1:]):
+            start, end = d.time_window
+            model.add_client(
+                x=int(round(lng * 1e6)),
+                y=int(round(lat * 1e6)),
+                delivery=int(d.quantity),
+                tw_early=max(0, int((start - current_time).total_seconds())),
+                tw_late=max(0, int((end - current_time).total_seconds()))
+            )
+        locations = model.locations
+        for i, frm in enumerate(locations):
+            for j, to in enumerate(locations):
+                model.add_edge(
+                    frm, to,
+                    distance=int(distances[i, j]),
+                    duration=int(durations[i, j])
+                )
+
+        result = model.solve(stop=MaxRuntime(5), display=False)
+        if not result.is_feasible():
+            return None
+        # visits()返回的位置索引与positions的行号一致（工厂为0）
+        return [np.asarray(r.visits(), dtype=np.int64) for r in result.best.routes()]
+
+    def _fill_scratch(self, demands):
+        n = len(demands) + 1
+        if n > len(self._scratch_demands):
+            size = max(n, 2 * len(self._scratch_demands))
+            self._scratch_positions = np.empty((size, 2), dtype=np.float64)
+            self._scratch_demands = np.empty(size, dtype=np.float64)
+        positions = self._scratch_positions[:n]
+        quantities = self._scratch_demands[:n]
+        positions[0] = self.factory_location
+        quantities[0] = 0.0
+        for i, d in enumerate(demands, start=1):
+            positions[i] = d.location
+            quantities[i] = d.quantity
+        return positions, quantities
 
     def _generate_demands(self):
         current_time = datetime.now(self.tz)
-        return [
-            *self.data_stream.get_pending_orders(),
-            *[
-                self._create_demand(p, current_time)
-                for p in self.data_stream.get_hourly_production()
-                if p.timestamp > current_time - timedelta(minutes=55)
-            ]
-        ]
+        cutoff = current_time - self._PROD_CUTOFF
+        demands = list(self.data_stream.get_pending_orders())
+        demands.extend(
+            self._create_demand(p, current_time)
+            for p in self.data_stream.get_hourly_production()
+            if p.timestamp > cutoff
+        )
+        return demands
 
     def _create_demand(self, product, base_time):
         return DeliveryDemand(
@@ -183,8 +374,8 @@ class LogisticsOptimizer:
             quantity=product.amount,
             location=self.factory_location,
             time_window=(
-                base_time + timedelta(hours=1, minutes=15),
-                base_time + timedelta(hours=4)
+                base_time + self._TW_START,
+                base_time + self._TW_END
             )
         )
 